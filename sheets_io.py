@@ -0,0 +1,290 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# sheets_io.py – Acesso ao Google Sheets (OAuth, leitura das amostras e gravação
+# de STATUS / DATA / OS) usado pelo streamlit_app.py
+# ────────────────────────────────────────────────────────────────────────────────
+from __future__ import annotations
+import os, json, logging, random, threading, time
+from datetime import datetime, timedelta
+from functools import reduce
+from itertools import groupby
+from typing import Dict, Iterator, List, Tuple
+
+import orjson
+import streamlit as st
+from google.auth.exceptions import RefreshError, TransportError
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
+from google.auth.transport.requests import Request
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+# ╭────────────────────────── CONFIGURAÇÕES ───────────────────────────╮
+SCOPES         = ["https://www.googleapis.com/auth/spreadsheets"]
+SPREADSHEET_ID = "1VLDQUCO3Aw4ClAvhjkUsnBxG44BTjz-MjHK04OqPxYM"
+SHEET_NAME     = "Geral"
+TOKEN_PATH     = "token.json"
+
+REFRESH_MARGIN = timedelta(minutes=5)  # renova o token antes de expirar
+REFRESH_RETRY_S = 60                   # s – nova tentativa se a renovação falhar
+
+STATUS_COL  = "AF"                    # Status            ┐
+DATE_COL    = "AG"                    # Data              ├ contíguas (gravadas juntas)
+OS_COL      = "AH"                    # Ordem de Serviço  ┘
+SAMPLE_COL  = "G"                     # código da amostra
+LAST_COL    = OS_COL                  # última coluna lida/exportada (A:AH)
+
+STATUS_VAL  = "Retorno 1241"
+
+CACHE_TTL   = 60                      # s – validade do cache de leitura da planilha
+RANGES_PER_GET = 100                  # faixas de linhas por chamada batchGet
+RANGES_PER_UPDATE = 100               # faixas por chamada batchUpdate
+
+MAX_RETRIES  = 5                      # tentativas por chamada à API
+RETRY_STATUS = (429, 500, 503)        # cota estourada / erro transitório
+# ╰─────────────────────────────────────────────────────────────────────╯
+
+
+# ─────────────────────── Helpers Google Sheets ────────────────────────
+def _save_token(creds: Credentials) -> None:
+    with open(TOKEN_PATH, "w", encoding="utf-8") as fp:
+        fp.write(creds.to_json())
+
+
+@st.cache_resource
+def _authorize_google() -> Credentials:
+    creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES) if os.path.exists(TOKEN_PATH) else None
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            client_config = json.loads(st.secrets["GOOGLE_CLIENT_SECRET"])
+            flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
+            creds = flow.run_console()
+        _save_token(creds)
+    _schedule_refresh(creds)
+    return creds
+
+
+# módulo importado (não reexecutado a cada rerun) → locks, logger e timer únicos no processo
+_refresh_lock = threading.Lock()
+_timer_lock = threading.Lock()
+_refresh_timer: threading.Timer | None = None          # cadeia de renovação em vigor
+_log = logging.getLogger(__name__)
+
+
+def _schedule_refresh(
+    creds: Credentials, delay: float | None = None, chain: threading.Timer | None = None
+) -> None:
+    """Agenda a renovação do token para REFRESH_MARGIN antes de expirar.
+
+    Roda num Timer em segundo plano que se reagenda após cada renovação, então o
+    "Gerar planilha" nunca espera pelo endpoint de token do Google. Só existe uma
+    cadeia por processo: um novo agendamento cancela o anterior, e um reagendamento
+    vindo de uma cadeia já substituída (``chain``) é descartado.
+    """
+    global _refresh_timer
+    if not creds.refresh_token or not creds.expiry:
+        return
+    if delay is None:
+        delay = max((creds.expiry - datetime.utcnow() - REFRESH_MARGIN).total_seconds(), 0)
+    timer = threading.Timer(delay, _refresh_and_reschedule, args=(creds,))
+    timer.daemon = True
+    with _timer_lock:
+        if chain is not None and _refresh_timer is not chain:
+            return
+        if _refresh_timer is not None:
+            _refresh_timer.cancel()
+        _refresh_timer = timer
+    timer.start()
+
+
+def _refresh_and_reschedule(creds: Credentials) -> None:
+    chain = threading.current_thread()
+    if chain is not _refresh_timer:
+        return                                             # cadeia substituída (creds antigas)
+    try:
+        with _refresh_lock:
+            # outra thread (ou o próprio google-auth) pode já ter renovado
+            if creds.expiry - datetime.utcnow() <= REFRESH_MARGIN:
+                creds.refresh(Request())
+                try:
+                    _save_token(creds)
+                except OSError:
+                    # token em memória já está renovado: só a cópia em disco ficou velha
+                    _log.exception("Token renovado, mas não foi possível gravar %s.", TOKEN_PATH)
+    except TransportError:
+        _log.warning("Falha de rede ao renovar o token; nova tentativa em %s s.", REFRESH_RETRY_S, exc_info=True)
+        _schedule_refresh(creds, delay=REFRESH_RETRY_S, chain=chain)
+        return
+    except RefreshError:
+        # token revogado/expirado (invalid_grant): insistir não resolve; a próxima
+        # chamada à API expõe o erro ao usuário
+        _log.exception("Renovação do token recusada; renovação em segundo plano interrompida.")
+        return
+    _schedule_refresh(creds, chain=chain)
+
+
+class _OrjsonModel(JsonModel):
+    """JsonModel que codifica/decodifica os corpos com orjson (C) em vez de json."""
+
+    def serialize(self, body_value):
+        if isinstance(body_value, dict) and "data" not in body_value and self._data_wrapper:
+            body_value = {"data": body_value}
+        # bytes UTF-8: o content-length é calculado com len(body), que precisa contar bytes
+        return orjson.dumps(body_value)
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().deserialize(content)
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
+
+
+@st.cache_resource
+def _svc():
+    return build(
+        "sheets", "v4",
+        credentials=_authorize_google(),
+        model=_OrjsonModel(),
+        static_discovery=True,                # documento de discovery empacotado, sem HTTP
+        cache_discovery=False,
+    )
+
+
+def _execute(request):
+    """Executa uma requisição da API com backoff exponencial em 429 / 500 / 503.
+
+    Respeita o Retry-After do servidor quando vier; senão espera 2^n s + jitter
+    (máx. 60 s), até MAX_RETRIES tentativas. Outros erros sobem na hora.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            return request.execute()
+        except HttpError as e:
+            if e.resp.status not in RETRY_STATUS or attempt == MAX_RETRIES - 1:
+                raise
+            retry_after = str(e.resp.get("retry-after", ""))
+            time.sleep(float(retry_after) if retry_after.isdigit() else min(2 ** attempt + random.random(), 60))
+
+
+def _col_to_idx(col: str) -> int:
+    return reduce(lambda idx, c: idx * 26 + ord(c) - 64, col.upper(), 0) - 1
+
+
+# índices 0-based das colunas gravadas, resolvidos uma única vez na importação
+STATUS_IDX, DATE_IDX, OS_IDX = map(_col_to_idx, (STATUS_COL, DATE_COL, OS_COL))
+SAMPLE_IDX = _col_to_idx(SAMPLE_COL)                           # conferência das linhas lidas
+
+# update_rows grava STATUS/DATA/OS como um único retângulo STATUS_COL:OS_COL
+if (DATE_IDX, OS_IDX) != (STATUS_IDX + 1, STATUS_IDX + 2):
+    raise RuntimeError("STATUS_COL, DATE_COL e OS_COL devem ser colunas vizinhas, nessa ordem.")
+
+
+def _runs(rows_idx: List[int]) -> Iterator[Tuple[int, int]]:
+    """Agrupa índices de linha ordenados em sequências consecutivas (primeira, última)."""
+    for _, run in groupby(enumerate(rows_idx), key=lambda p: p[1] - p[0]):
+        run = [r for _, r in run]
+        yield run[0], run[-1]
+
+
+def fetch_keys() -> Tuple[List[str], List[str]]:
+    """Lê apenas o cabeçalho e a coluna de amostras (linha 2 em diante).
+
+    Os códigos já saem normalizados (str, sem espaços).
+    """
+    res = _execute(
+        _svc()
+        .spreadsheets()
+        .values()
+        .batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[f"{SHEET_NAME}!A1:{LAST_COL}1", f"{SHEET_NAME}!{SAMPLE_COL}2:{SAMPLE_COL}"],
+            # valor exibido, como o usuário o digita e como sai no Excel
+            # ("000123" formatado não vira 123)
+            valueRenderOption="FORMATTED_VALUE",
+            fields="valueRanges(values)",
+        )
+    )
+    header_vr, keys_vr = res["valueRanges"]
+    header = header_vr.get("values", [[]])[0]
+    keys = [r[0].strip() if r else "" for r in keys_vr.get("values", [])]   # FORMATTED_VALUE: já são str
+    return header, keys
+
+
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=False)
+def sheet_index() -> Tuple[List[str], Dict[str, List[int]]]:
+    """Cabeçalho + {código: [linhas 1-based]}, montado uma vez por leitura da planilha.
+
+    Fica em cache_resource (sem cópia a cada acesso) → tratar como somente leitura.
+    Um código repetido na planilha mapeia para todas as suas linhas.
+    """
+    header, keys = fetch_keys()
+    index: Dict[str, List[int]] = {}
+    for i, code in enumerate(keys, start=2):
+        if code:
+            index.setdefault(code, []).append(i)
+    return header, index
+
+
+def iter_rows(rows_idx: List[int]) -> Iterator[Tuple[int, List[str]]]:
+    """Busca só as linhas indicadas (ordenadas, 1-based), uma faixa por sequência."""
+    values, runs = _svc().spreadsheets().values(), list(_runs(rows_idx))
+    for k in range(0, len(runs), RANGES_PER_GET):
+        batch = runs[k:k + RANGES_PER_GET]
+        res = _execute(values.batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[f"{SHEET_NAME}!A{first}:{LAST_COL}{last}" for first, last in batch],
+            valueRenderOption="FORMATTED_VALUE",
+            majorDimension="ROWS",
+            fields="valueRanges(values)",
+        ))
+        for (first, last), vr in zip(batch, res.get("valueRanges", [])):
+            rows = vr.get("values", [])
+            for i in range(first, last + 1):
+                yield i, rows[i - first] if i - first < len(rows) else []
+
+
+def update_rows(rows_idx: List[int], today: str, os_vals: List[str]) -> None:
+    """Escreve STATUS, DATA e OS em cada linha indicada (1-based)."""
+    if len(rows_idx) != len(os_vals):
+        st.error("Inconsistência interna: linhas e OS não batem.")
+        st.stop()
+    if not rows_idx:
+        return                                                 # nada a gravar: nem abre o cliente
+
+    # STATUS, DATA e OS são colunas vizinhas e linhas consecutivas formam um
+    # único retângulo AF{r0}:AH{rk} → um range por sequência, não por célula
+    svc = _svc()
+    by_row = dict(zip(rows_idx, os_vals))                      # remove linhas repetidas
+    data = [
+        {
+            "range": f"{SHEET_NAME}!{STATUS_COL}{first}:{OS_COL}{last}",
+            "values": [[STATUS_VAL, today, by_row[i]] for i in range(first, last + 1)],
+        }
+        for first, last in _runs(sorted(by_row))
+    ]
+
+    # lotes de RANGES_PER_UPDATE: uma falha transitória não derruba o envio inteiro
+    try:
+        for k in range(0, len(data), RANGES_PER_UPDATE):
+            _execute(svc.spreadsheets().values().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID,
+                body={"valueInputOption": "RAW", "data": data[k:k + RANGES_PER_UPDATE]},
+                fields="totalUpdatedCells",               # resposta enxuta: só o total
+            ))
+    except HttpError as e:
+        # lotes anteriores ao que falhou já estão gravados: avisa para não parecer tudo-ou-nada
+        done = sum(len(d["values"]) for d in data[:k])
+        if done:
+            st.error(
+                f"❌ Falha ao gravar no Google Sheets: {e}\n\n"
+                f"⚠️ Gravação **parcial**: {done} de {len(by_row)} linha(s) ({k} de {len(data)} faixa(s)) "
+                "já foram marcadas antes do erro. Gere novamente para completar."
+            )
+        else:
+            st.error(f"❌ Falha ao gravar no Google Sheets: {e}")
+        st.stop()
@@ -3,94 +3,61 @@
 # e baixar Excel com as mesmas colunas gravadas no Sheets
 # ────────────────────────────────────────────────────────────────────────────────
 from __future__ import annotations
-import io, os, json
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List
+from typing import List, Tuple
 
 import pandas as pd
 import streamlit as st
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
+import xlsxwriter
 
-# ╭────────────────────────── CONFIGURAÇÕES ───────────────────────────╮
-SCOPES         = ["https://www.googleapis.com/auth/spreadsheets"]
-SPREADSHEET_ID = "1VLDQUCO3Aw4ClAvhjkUsnBxG44BTjz-MjHK04OqPxYM"
-SHEET_NAME     = "Geral"
-
-STATUS_COL  = "AF"                    # Status
-DATE_COL    = "AG"                    # Data
-OS_COL      = "AH"                    # Ordem de Serviço
-SAMPLE_COL  = "G"                     # código da amostra
+from sheets_io import (
+    SAMPLE_IDX, STATUS_IDX, STATUS_VAL,
+    iter_rows, sheet_index, update_rows,
+)
 
-STATUS_VAL  = "Retorno 1241"
+# ╭────────────────────────── CONFIGURAÇÕES ───────────────────────────╮
 DATE_FMT    = "%d/%m/%Y"
-# ╰─────────────────────────────────────────────────────────────────────╯
-
 
-# ─────────────────────── Helpers Google Sheets ────────────────────────
-@st.cache_resource
-def _authorize_google() -> Credentials:
-    token_path = "token.json"
-    creds = Credentials.from_authorized_user_file(token_path, SCOPES) if os.path.exists(token_path) else None
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            client_config = json.loads(st.secrets["GOOGLE_CLIENT_SECRET"])
-            flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
-            creds = flow.run_console()
-        with open(token_path, "w", encoding="utf-8") as fp:
-            fp.write(creds.to_json())
-    return creds
-
-
-@st.cache_resource
-def _svc():
-    return build("sheets", "v4", credentials=_authorize_google(), cache_discovery=False)
-
-
-def _col_to_idx(col: str) -> int:
-    idx = 0
-    for c in col: idx = idx * 26 + (ord(c.upper()) - 64)
-    return idx - 1
-
-
-def fetch_sheet() -> List[List[str]]:
-    res = (
-        _svc()
-        .spreadsheets()
-        .values()
-        .get(spreadsheetId=SPREADSHEET_ID, range=SHEET_NAME, valueRenderOption="FORMATTED_VALUE")
-        .execute()
-    )
-    return res.get("values", [])
+XLSX_OPTS   = {"constant_memory": True, "strings_to_formulas": False, "strings_to_urls": False}
+# ╰─────────────────────────────────────────────────────────────────────╯
 
 
-def update_rows(rows_idx: List[int], today: str, os_vals: List[str]) -> None:
-    """Escreve STATUS, DATA e OS em cada linha indicada (1-based)."""
-    if len(rows_idx) != len(os_vals):
-        st.error("Inconsistência interna: linhas e OS não batem.")
-        st.stop()
-
-    svc, data = _svc(), []
-    for idx, os_val in zip(rows_idx, os_vals):
-        data.extend([
-            {"range": f"{SHEET_NAME}!{STATUS_COL}{idx}", "values": [[STATUS_VAL]]},
-            {"range": f"{SHEET_NAME}!{DATE_COL}{idx}",   "values": [[today]]},
-            {"range": f"{SHEET_NAME}!{OS_COL}{idx}",     "values": [[os_val]]},
-        ])
-
-    try:
-        svc.spreadsheets().values().batchUpdate(
-            spreadsheetId=SPREADSHEET_ID,
-            body={"valueInputOption": "RAW", "data": data},
-        ).execute()
-    except HttpError as e:
-        st.error(f"❌ Falha ao gravar no Google Sheets: {e}")
-        st.stop()
+# ─────────────────────────── Helpers Excel ────────────────────────────
+def build_xlsx(
+    header: List[str],
+    rows: List[List[str]],
+    os_vals: List[str],
+    today: str,
+    missing: List[Tuple[str, str]],
+) -> io.BytesIO:
+    """Monta o Excel: aba "Amostras" (ok) + "Nao_Encontradas" (se houver).
+
+    Não toca em st.* nem na rede → pode rodar numa thread em paralelo ao update_rows.
+    constant_memory grava linha a linha (ordem estrita) sem reter o arquivo todo.
+    """
+    buf = io.BytesIO()
+    wb = xlsxwriter.Workbook(buf, XLSX_OPTS)
+
+    ws = wb.add_worksheet("Amostras")
+    ws.write_row(0, 0, header)
+    for i, (row, os_val) in enumerate(zip(rows, os_vals), start=1):
+        # linha original como veio + AF:AH sobrescritas na mesma linha; células
+        # vazias não precisam de preenchimento e `row` não é alterada
+        ws.write_row(i, 0, row)
+        ws.write_row(i, STATUS_IDX, (STATUS_VAL, today, os_val))
+
+    if missing:
+        ws_missing = wb.add_worksheet("Nao_Encontradas")
+        ws_missing.write_row(0, 0, ["Amostra", "OS informada"])
+        for i, pair in enumerate(missing, start=1):
+            ws_missing.write_row(i, 0, pair)
+
+    wb.close()
+    buf.seek(0)
+    return buf
 
 
 # ─────────────────────────── Interface Streamlit ──────────────────────
@@ -98,140 +65,198 @@ st.set_page_config(page_title="Selecionar Amostras", page_icon="🛢️", layout
 st.title("Selecionar Amostras 🛢️")
 
 # ---------- estado ----------
-st.session_state.setdefault("lista", {})     # {código: OS}
+# lista em colunas paralelas (SoA): codes[i] ↔ oss[i]; code_to_pos = {código: i}
+st.session_state.setdefault("codes", [])
+st.session_state.setdefault("oss", [])
+st.session_state.setdefault("code_to_pos", {})
+st.session_state.setdefault("editor_v", 0)   # versão da chave do data_editor
 st.session_state.setdefault("in_codigo", "")
 st.session_state.setdefault("in_os", "")
 st.session_state.setdefault("msg", "")
+st.session_state.setdefault("xlsx", None)    # (chave da lista, bytes, nome, resumo) do último Excel
+
+# ---------- callbacks ----------
+def _editor_key() -> str:
+    return f"editor_{st.session_state.editor_v}"
+
+def _set_list(pairs: List[Tuple[str, str]]) -> None:
+    st.session_state.codes = [c for c, _ in pairs]
+    st.session_state.oss = [o for _, o in pairs]
+    st.session_state.code_to_pos = {c: i for i, c in enumerate(st.session_state.codes)}
 
-# ---------- callback ----------
 def add_item() -> None:
     cod, osv = st.session_state.in_codigo.strip(), st.session_state.in_os.strip()
     if not cod or not osv:
         st.session_state.msg = "Preencha **ambos** os campos."
         return
-    if cod in st.session_state.lista:
+    if cod in st.session_state.code_to_pos:
         st.session_state.msg = f"Amostra {cod} já lançada."
         return
-    st.session_state.lista[cod] = osv
+    st.session_state.code_to_pos[cod] = len(st.session_state.codes)
+    st.session_state.codes.append(cod)
+    st.session_state.oss.append(osv)
     st.session_state.in_codigo = ""
     st.session_state.in_os = ""
     st.session_state.msg = ""
 
-# ---------- formulário ----------
-c1, c2, c3 = st.columns([3, 3, 1])
-with c1: st.text_input("📷 Código da amostra", key="in_codigo")
-with c2: st.text_input("🔧 Ordem de Serviço (OS)", key="in_os")
-with c3: st.button("➕ Adicionar", on_click=add_item)
+def _clean(v) -> str:
+    return str(v or "").strip()
+
+def _half_filled(delta: dict) -> bool:
+    return any(not _clean(a.get("Amostra")) or not _clean(a.get("OS")) for a in delta.get("added_rows", ()))
+
+def apply_edits() -> None:
+    """Aplica numa só passada o delta do data_editor (edições, inclusões e remoções)."""
+    delta = st.session_state[_editor_key()]
+    # linha incluída pela tabela com só um campo preenchido: cada célula confirmada
+    # dispara on_change, então espera o segundo campo sem aplicar nem remontar
+    # (o delta inteiro fica pendente; o "Gerar" recusa rodar enquanto isso)
+    if _half_filled(delta):
+        return
+    rows = [[c, o] for c, o in zip(st.session_state.codes, st.session_state.oss)]
+    for i, change in delta["edited_rows"].items():
+        row = rows[int(i)]
+        row[0], row[1] = change.get("Amostra", row[0]), change.get("OS", row[1])
+    deleted = set(delta["deleted_rows"])
+    rows = [r for i, r in enumerate(rows) if i not in deleted]
+    rows += [[a.get("Amostra"), a.get("OS")] for a in delta["added_rows"]]
+
+    pairs, seen = [], set()
+    for cod, osv in rows:
+        cod, osv = _clean(cod), _clean(osv)
+        if cod and osv and cod not in seen:
+            seen.add(cod)
+            pairs.append((cod, osv))
+
+    if len(pairs) < len(rows):
+        st.session_state.msg = "Linhas sem **ambos** os campos ou repetidas foram descartadas."
+    elif deleted:
+        st.session_state.msg = f"{len(deleted)} amostra(s) removida(s)."
+    else:
+        st.session_state.msg = ""
+    _set_list(pairs)
+    st.session_state.editor_v += 1               # nova chave → editor parte da lista já aplicada
+
+def _list_key(codes: List[str], oss: List[str], today: str) -> str:
+    return hashlib.blake2b(repr((today, sorted(zip(codes, oss)))).encode(), digest_size=16).hexdigest()
+
+def reload_sheet() -> None:
+    # descarta o índice em cache → o próximo "Gerar" relê a coluna de códigos
+    # e grava de novo, sem reaproveitar o último Excel
+    sheet_index.clear()
+    st.session_state.xlsx = None
+
+# ---------- formulário (st.form: um rerun por envio, não por campo editado) ----------
+with st.form("codigo_os"):
+    c1, c2, c3 = st.columns([3, 3, 1])
+    with c1: st.text_input("📷 Código da amostra", key="in_codigo")
+    with c2: st.text_input("🔧 Ordem de Serviço (OS)", key="in_os")
+    with c3: st.form_submit_button("➕ Adicionar", on_click=add_item)
 
 if st.session_state.msg: st.warning(st.session_state.msg)
 
-# ---------- tabela resumo (com botão de remoção por linha) ----------
-if st.session_state.lista:
+# ---------- tabela resumo (editável; remoção pela própria tabela) ----------
+if st.session_state.codes:
     st.subheader("Lista de amostras")
-    h1, h2, h3 = st.columns([3, 3, 1])
-    h1.markdown("**Amostra**")
-    h2.markdown("**OS**")
-    h3.markdown("**Ações**")
-
-    for cod, osv in list(st.session_state.lista.items()):
-        c1, c2, c3 = st.columns([3, 3, 1])
-        c1.code(cod)
-        c2.write(osv)
-        if c3.button("🗑️ Remover", key=f"rm_{cod}"):
-            st.session_state.lista.pop(cod, None)
-            st.session_state.msg = f"Amostra {cod} removida."
-            st.rerun()
+    st.data_editor(
+        pd.DataFrame({"Amostra": st.session_state.codes, "OS": st.session_state.oss}),
+        key=_editor_key(),
+        num_rows="dynamic",
+        hide_index=True,
+        on_change=apply_edits,
+    )
 else:
     st.info("Nenhuma amostra adicionada.")
 
 # ---------- botões ----------
-col1, col2 = st.columns(2)
+col1, col2, col3 = st.columns(3)
 with col1:
     if st.button("🗑️ Limpar lista"):
-        st.session_state.lista.clear()
+        _set_list([])
         st.session_state.msg = ""
 with col2:
+    st.button("🔄 Recarregar planilha", on_click=reload_sheet)
+with col3:
     gerar = st.button("📥 Gerar planilha")
 
 # ──────────────────── Seleção, checagem, gravação e exportação ───────────────────
 if gerar:
-    if not st.session_state.lista:
+    if _half_filled(st.session_state.get(_editor_key(), {})):
+        st.error("✏️ Complete (ou remova) a linha nova da tabela: as alterações da tabela ainda não foram aplicadas.")
+        st.stop()
+    if not st.session_state.codes:
         st.error("📋 A lista está vazia.")
         st.stop()
 
-    # 1) Localiza as amostras na planilha
-    with st.spinner("Consultando planilha…"):
-        sheet = fetch_sheet()
-        if not sheet: st.error("Aba vazia."); st.stop()
-
-        header, *data = sheet
-        sample_idx, os_idx = _col_to_idx(SAMPLE_COL), _col_to_idx(OS_COL)
-
-        rows_idx, os_vals, rows_data = [], [], []
-        encontrados = set()
-
-        for i, row in enumerate(data, start=2):
-            code = str(row[sample_idx]).strip() if sample_idx < len(row) else ""
-            if code in st.session_state.lista:
-                rows_idx.append(i)
-                os_vals.append(st.session_state.lista[code])
-                rows_data.append(row)
-                encontrados.add(code)
-
-        # 1b) Checagem de não encontrados
-        todos_digitados = list(st.session_state.lista.keys())
-        nao_encontrados = [c for c in todos_digitados if c not in encontrados]
-
-        if nao_encontrados:
-            st.warning(
-                "⚠️ As seguintes amostras **não foram localizadas** na planilha e, portanto, **não serão atualizadas**:\n\n"
-                + "\n".join(f"- `{c}`" for c in nao_encontrados)
-            )
-
-        if not rows_idx:
-            # Nenhuma encontrada, encerra
-            st.stop()
-
-    # 2) Atualiza AF / AG / AH apenas para as encontradas
+    codes, oss, pos = st.session_state.codes, st.session_state.oss, st.session_state.code_to_pos
     today = datetime.now().strftime(DATE_FMT)
-    with st.spinner("Gravando no Google Sheets…"):
-        update_rows(rows_idx, today, os_vals)
-
-    # 3) Prepara DataFrame já com STATUS & DATA (encontradas)
-    status_idx, date_idx = _col_to_idx(STATUS_COL), _col_to_idx(DATE_COL)
-    norm_rows = []
-    for row, os_val in zip(rows_data, os_vals):
-        row += [""] * (len(header) - len(row))        # completa largura
-        row[status_idx] = STATUS_VAL
-        row[date_idx]   = today
-        row[os_idx]     = os_val
-        norm_rows.append(row)
-
-    df_ok = pd.DataFrame(norm_rows, columns=header)
-
-    # 4) Exporta Excel: aba "Amostras" (ok) + "Nao_Encontradas" (se houver)
-    with st.spinner("Gerando Excel…"):
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="xlsxwriter") as xw:
-            df_ok.to_excel(xw, index=False, sheet_name="Amostras")
+
+    # mesma lista (códigos + OS) no mesmo dia já foi gravada → reaproveita o Excel
+    key = _list_key(codes, oss, today)
+    last = st.session_state.xlsx
+    if not (last and last[0] == key):
+        # 1) Localiza as amostras no índice {código: linhas} (em cache): uma consulta
+        #    por código digitado, independente do tamanho da planilha
+        with st.spinner("Consultando planilha…"):
+            # o índice fica em cache e outra pessoa pode inserir/remover/ordenar linhas
+            # nesse meio-tempo: confere a coluna G das linhas buscadas antes de gravar
+            # e, se divergir, relê a planilha uma vez
+            for _ in range(2):
+                header, index = sheet_index()
+                if not header: st.error("Aba vazia."); st.stop()
+
+                hits = sorted((i, pos[c]) for c in codes for i in index.get(c, ()))
+                rows_idx = [i for i, _ in hits]
+                # busca só as linhas encontradas (necessárias para o Excel)
+                rows = [row for _, row in iter_rows(rows_idx)] if rows_idx else []
+                if all(
+                    len(row) > SAMPLE_IDX and row[SAMPLE_IDX].strip() == codes[p]
+                    for row, (_, p) in zip(rows, hits)
+                ):
+                    break
+                sheet_index.clear()
+            else:
+                st.error("❌ A planilha mudou durante a consulta. Tente novamente.")
+                st.stop()
+            os_vals = [oss[p] for _, p in hits]
+
+            # 1b) Checagem de não encontrados
+            nao_encontrados = [c for c in codes if c not in index]
 
             if nao_encontrados:
-                df_missing = pd.DataFrame(
-                    [{"Amostra": c, "OS informada": st.session_state.lista[c]} for c in nao_encontrados]
+                st.warning(
+                    "⚠️ As seguintes amostras **não foram localizadas** na planilha e, portanto, **não serão atualizadas**:\n\n"
+                    + "\n".join(f"- `{c}`" for c in nao_encontrados)
                 )
-                df_missing.to_excel(xw, index=False, sheet_name="Nao_Encontradas")
-
-        buf.seek(0)
 
-    # 5) Mensagem final com resumo
-    msg = f"✔️ {len(df_ok)} amostra(s) atualizada(s) e exportada(s)."
-    if nao_encontrados:
-        msg += f" ❗ {len(nao_encontrados)} amostra(s) não encontrada(s) (veja aba 'Nao_Encontradas' no Excel)."
+            if not rows_idx:
+                # Nenhuma encontrada, encerra
+                st.stop()
+
+        # 2) Atualiza AF / AG / AH apenas para as encontradas enquanto o Excel é
+        #    montado numa thread: latência total ≈ max(rede, CPU), não a soma
+        with st.spinner("Gravando no Google Sheets e gerando Excel…"):
+            missing = [(c, oss[pos[c]]) for c in nao_encontrados]
+            with ThreadPoolExecutor(max_workers=1) as ex:
+                fut_xlsx = ex.submit(build_xlsx, header, rows, os_vals, today, missing)
+                update_rows(rows_idx, today, os_vals)
+                buf = fut_xlsx.result()
+
+        # 3) Mensagem final com resumo
+        msg = f"✔️ {len(rows_idx)} amostra(s) atualizada(s) e exportada(s)."
+        if nao_encontrados:
+            msg += f" ❗ {len(nao_encontrados)} amostra(s) não encontrada(s) (veja aba 'Nao_Encontradas' no Excel)."
+        st.session_state.xlsx = (key, buf.getvalue(), f"amostras_{today}.xlsx", msg)
+
+# 4) Download do último Excel gerado: sobrevive aos reruns (inclusive o do próprio
+#    clique), mas só enquanto a lista atual for a mesma que o gerou
+last = st.session_state.xlsx
+if last and last[0] == _list_key(st.session_state.codes, st.session_state.oss, datetime.now().strftime(DATE_FMT)):
+    _, data, name, msg = last
     st.success(msg)
-
     st.download_button(
         "⬇️ Baixar Excel",
-        data=buf,
-        file_name=f"amostras_{today}.xlsx",
+        data=data,
+        file_name=name,
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )